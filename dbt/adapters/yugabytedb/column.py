@@ -5,8 +5,7 @@ class YugabytedbColumn(Column):
     @property
     def data_type(self):
         # on yugabytedb, do not convert 'text' or 'varchar' to 'varchar()'
-        if self.dtype.lower() == "text" or (
-            self.dtype.lower() == "character varying" and self.char_size is None
-        ):
+        dtype = self.dtype.lower()
+        if dtype == "text" or (dtype == "character varying" and self.char_size is None):
             return self.dtype
         return super().data_type
@@ -1,7 +1,18 @@
-from contextlib import contextmanager
+import atexit
+import random
+import re
+import string
+import threading
+import time
+from functools import cached_property
 
 import psycopg2
-from psycopg2.extensions import string_types
+from psycopg2 import DatabaseError, Error, InterfaceError, OperationalError
+from psycopg2.extensions import (
+    string_types,
+    TRANSACTION_STATUS_IDLE,
+    TRANSACTION_STATUS_UNKNOWN,
+)
 
 import dbt.exceptions
 from dbt.adapters.base import Credentials
@@ -10,17 +21,70 @@ from dbt.contracts.connection import AdapterResponse
 from dbt.events import AdapterLogger
 from dbt.events.contextvars import get_node_info
 from dbt.events.functions import fire_event
-from dbt.events.types import SQLCommit
+from dbt.events.types import ConnectionClosed, SQLCommit
 
 from dbt.helper_types import Port
+from dbt.utils import cast_to_str
 from dataclasses import dataclass
-from typing import Optional
+from typing import Any, Callable, Dict, FrozenSet, List, Optional
 from typing_extensions import Annotated
 from mashumaro.jsonschema.annotations import Maximum, Minimum
 
 
 logger = AdapterLogger("Yugabytedb")
 
+_CONNECTION_KEYS = (
+    "host",
+    "port",
+    "user",
+    "database",
+    "schema",
+    "connect_timeout",
+    "role",
+    "search_path",
+    "keepalives_idle",
+    "sslmode",
+    "sslcert",
+    "sslkey",
+    "sslrootcert",
+    "application_name",
+    "retries",
+    "enable_transaction",
+)
+
+# the numeric parts of a status message, e.g. the "0 1" of "INSERT 0 1"
+_STATUS_MESSAGE_DIGITS = re.compile(r"\s*(?<!\S)\d+(?!\S)")
+
+
+# new connections are opened at most this many at a time, and this many seconds apart,
+# so that a run with many threads doesn't hit the tserver with a burst of handshakes
+_MAX_CONCURRENT_CONNECTS = 8
+_MIN_CONNECT_INTERVAL = 0.02
+_connect_semaphore = threading.BoundedSemaphore(_MAX_CONCURRENT_CONNECTS)
+_connect_lock = threading.Lock()
+_last_connect = [0.0]
+
+
+def _throttled_connect(**kwargs):
+    with _connect_semaphore:
+        with _connect_lock:
+            delay = _last_connect[0] + _MIN_CONNECT_INTERVAL - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            _last_connect[0] = time.monotonic()
+        return psycopg2.connect(**kwargs)
+
+
+_ASCII_LOWERCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def _role_name(role: str) -> str:
+    # `set role` took the role as an identifier while a startup option takes it literally,
+    # so fold it the way postgres folds identifiers: unquote quoted names, lower-case the rest
+    if len(role) >= 2 and role.startswith('"') and role.endswith('"'):
+        return role[1:-1].replace('""', '"')
+    return role.translate(_ASCII_LOWERCASE)
+
 
 @dataclass
 class YugabytedbCredentials(Credentials):
@@ -52,56 +116,195 @@ class YugabytedbCredentials(Credentials):
         return self.host
 
     def _connection_keys(self):
-        return (
-            "host",
-            "port",
-            "user",
-            "database",
-            "schema",
-            "connect_timeout",
-            "role",
-            "search_path",
-            "keepalives_idle",
-            "sslmode",
-            "sslcert",
-            "sslkey",
-            "sslrootcert",
-            "application_name",
-            "retries",
-            "enable_transaction"
-        )
+        return _CONNECTION_KEYS
+
+    @cached_property
+    def psycopg2_kwargs(self) -> Dict[str, Any]:
+        """The keyword arguments passed to psycopg2.connect()."""
+        kwargs: Dict[str, Any] = {
+            "dbname": self.database,
+            "user": self.user,
+            "host": self.host,
+            "password": self.password,
+            "port": self.port,
+            "connect_timeout": self.connect_timeout,
+        }
+        # we don't want to pass 0 along to connect() as yugabytedb will try to
+        # call an invalid setsockopt() call (contrary to the docs).
+        if self.keepalives_idle:
+            kwargs["keepalives_idle"] = self.keepalives_idle
 
+        # psycopg2 doesn't support search_path officially,
+        # see https://github.com/psycopg/psycopg2/issues/465
+        # see https://yugabytedbql.org/docs/9.5/libpq-connect.html
+        options = []
+        search_path = self.search_path
+        if search_path is not None and search_path != "":
+            escaped_search_path = search_path.replace(" ", "\\ ")
+            options.append(f"-c search_path={escaped_search_path}")
 
-class YugabytedbConnectionManager(SQLConnectionManager):
-    TYPE = "yugabytedb"
+        # setting the role at startup saves a round trip over running `set role` afterwards
+        if self.role:
+            escaped_role = _role_name(self.role).replace("\\", "\\\\").replace(" ", "\\ ")
+            options.append(f"-c role={escaped_role}")
 
-    @contextmanager
-    def exception_handler(self, sql):
-        try:
-            yield
+        if options:
+            kwargs["options"] = " ".join(options)
+
+        if self.sslmode:
+            kwargs["sslmode"] = self.sslmode
+
+        if self.sslcert is not None:
+            kwargs["sslcert"] = self.sslcert
+
+        if self.sslkey is not None:
+            kwargs["sslkey"] = self.sslkey
+
+        if self.sslrootcert is not None:
+            kwargs["sslrootcert"] = self.sslrootcert
+
+        if self.application_name:
+            kwargs["application_name"] = self.application_name
 
-        except psycopg2.DatabaseError as e:
-            logger.debug("Yugabytedb error: {}".format(str(e)))
+        return kwargs
+
+
+class _ExceptionHandler:
+    """
+    The context manager returned by YugabytedbConnectionManager.exception_handler().
+
+    It is a plain class rather than a @contextmanager generator because it wraps every
+    statement, and the success path then costs no more than the __enter__/__exit__ calls.
+    """
+
+    def __init__(self, connection_manager, sql):
+        self.connection_manager = connection_manager
+        self.sql = sql
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None or not issubclass(exc_type, Exception):
+            return False
+
+        if issubclass(exc_type, DatabaseError):
+            logger.debug(f"Yugabytedb error: {exc_value}")
 
             try:
-                self.rollback_if_open()
-            except psycopg2.Error:
+                self.connection_manager.rollback_if_open()
+            except Error:
                 logger.debug("Failed to release connection!")
                 pass
 
-            raise dbt.exceptions.DbtDatabaseError(str(e).strip()) from e
+            raise dbt.exceptions.DbtDatabaseError(str(exc_value).strip()) from exc_value
+
+        logger.debug("Error running SQL: {}", self.sql)
+        logger.debug("Rolling back transaction.")
+        self.connection_manager.rollback_if_open()
+        if isinstance(exc_value, dbt.exceptions.DbtRuntimeError):
+            # during a sql query, an internal to dbt exception was raised.
+            # this sounds a lot like a signal handler and probably has
+            # useful information, so raise it without modification.
+            return False
+
+        raise dbt.exceptions.DbtRuntimeError(exc_value) from exc_value
+
+
+class YugabytedbConnectionPool:
+    """
+    A per-process pool of idle psycopg2 connections opened with the same
+    connect() arguments. dbt closes its connection after every node, so
+    handing the handle back here lets the next node skip the TCP, TLS and
+    authentication handshake.
+
+    psycopg2.pool.ThreadedConnectionPool is not used because it only keeps
+    `minconn` idle connections around and opens all of them eagerly, while
+    dbt needs to keep up to `threads` connections without knowing that number.
+    """
+
+    def __init__(self, reset_role: bool = False):
+        self._idle: List = []
+        self._lock = threading.Lock()
+        self.reset_role = reset_role
+
+    def getconn(self, connect: Callable):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                handle = self._idle.pop()
+            # the server or a load balancer may have dropped the connection while it was idle
+            if self._is_alive(handle):
+                return handle
+            handle.close()
+        return connect()
+
+    def putconn(self, handle) -> bool:
+        # only keep connections that are still usable and not inside a transaction
+        if handle.closed or handle.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            return False
+        try:
+            self._reset(handle)
+        except Error:
+            return False
+        with self._lock:
+            self._idle.append(handle)
+        return True
+
+    @staticmethod
+    def _is_alive(handle) -> bool:
+        if handle.closed or handle.info.transaction_status == TRANSACTION_STATUS_UNKNOWN:
+            return False
+        try:
+            with handle.cursor() as cursor:
+                cursor.execute("select 1")
+        except Error:
+            return False
+        return True
+
+    def _reset(self, handle):
+        with handle.cursor() as cursor:
+            # drop whatever the last node left in the session: settings, temp tables,
+            # prepared statements, advisory locks, ...
+            cursor.execute("discard all")
+            if self.reset_role:
+                # discard all also drops the role set with `-c role=` at startup, while
+                # reset role restores it (it can't share a statement with discard all)
+                cursor.execute("reset role")
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for handle in idle:
+            handle.close()
+
 
-        except Exception as e:
-            logger.debug("Error running SQL: {}", sql)
-            logger.debug("Rolling back transaction.")
-            self.rollback_if_open()
-            if isinstance(e, dbt.exceptions.DbtRuntimeError):
-                # during a sql query, an internal to dbt exception was raised.
-                # this sounds a lot like a signal handler and probably has
-                # useful information, so raise it without modification.
-                raise
+class YugabytedbConnectionManager(SQLConnectionManager):
+    TYPE = "yugabytedb"
+
+    _pools: Dict[FrozenSet, YugabytedbConnectionPool] = {}
+    # pool each checked out handle belongs to, keyed by id(handle)
+    _handle_pools: Dict[int, YugabytedbConnectionPool] = {}
+    _pools_lock = threading.Lock()
 
-            raise dbt.exceptions.DbtRuntimeError(e) from e
+    @classmethod
+    def get_pool(cls, key: FrozenSet, reset_role: bool = False) -> YugabytedbConnectionPool:
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                pool = cls._pools[key] = YugabytedbConnectionPool(reset_role=reset_role)
+            return pool
+
+    @classmethod
+    def close_pools(cls):
+        with cls._pools_lock:
+            pools = list(cls._pools.values())
+        for pool in pools:
+            pool.closeall()
+
+    def exception_handler(self, sql):
+        return _ExceptionHandler(self, sql)
 
     @classmethod
     def open(cls, connection):
@@ -109,54 +312,26 @@ class YugabytedbConnectionManager(SQLConnectionManager):
             logger.debug("Connection is already open, skipping open.")
             return connection
 
-        credentials = cls.get_credentials(connection.credentials)
-        kwargs = {}
-        # we don't want to pass 0 along to connect() as yugabytedb will try to
-        # call an invalid setsockopt() call (contrary to the docs).
-        if credentials.keepalives_idle:
-            kwargs["keepalives_idle"] = credentials.keepalives_idle
-
-        # psycopg2 doesn't support search_path officially,
-        # see https://github.com/psycopg/psycopg2/issues/465
-        search_path = credentials.search_path
-        if search_path is not None and search_path != "":
-            # see https://yugabytedbql.org/docs/9.5/libpq-connect.html
-            kwargs["options"] = "-c search_path={}".format(search_path.replace(" ", "\\ "))
-
-        if credentials.sslmode:
-            kwargs["sslmode"] = credentials.sslmode
-
-        if credentials.sslcert is not None:
-            kwargs["sslcert"] = credentials.sslcert
-
-        if credentials.sslkey is not None:
-            kwargs["sslkey"] = credentials.sslkey
-
-        if credentials.sslrootcert is not None:
-            kwargs["sslrootcert"] = credentials.sslrootcert
-
-        if credentials.application_name:
-            kwargs["application_name"] = credentials.application_name
+        credentials = connection.credentials
+        kwargs = credentials.psycopg2_kwargs
+        pool = cls.get_pool(frozenset(kwargs.items()), reset_role=bool(credentials.role))
 
         def connect():
-            handle = psycopg2.connect(
-                dbname=credentials.database,
-                user=credentials.user,
-                host=credentials.host,
-                password=credentials.password,
-                port=credentials.port,
-                connect_timeout=credentials.connect_timeout,
-                **kwargs,
-            )
-            # We wil disable autocommit, which also means that a transaction is 
-            # started at the first command execution.
-            # Reference:
-            #   - https://www.psycopg.org/docs/connection.html#connection.autocommit
-            # handle.set_session(autocommit=False)
-            handle.set_session(autocommit=True)
+            handle = pool.getconn(lambda: _throttled_connect(**kwargs))
+            try:
+                # We wil disable autocommit, which also means that a transaction is 
+                # started at the first command execution.
+                # Reference:
+                #   - https://www.psycopg.org/docs/connection.html#connection.autocommit
+                # handle.set_session(autocommit=False)
+                handle.set_session(autocommit=True)
+            except Exception:
+                handle.close()
+                raise
 
-            if credentials.role:
-                handle.cursor().execute("set role {}".format(credentials.role))
+            # only register the handle once it is fully set up
+            with cls._pools_lock:
+                cls._handle_pools[id(handle)] = pool
             return handle
 
         retryable_exceptions = [
@@ -165,11 +340,12 @@ class YugabytedbConnectionManager(SQLConnectionManager):
             # psycopg2 which doesn't provide subclasses for errors without a SQLSTATE error code.
             # The limitation has been known for a while and there are no efforts to tackle it.
             # See: https://github.com/psycopg/psycopg2/issues/682
-            psycopg2.errors.OperationalError,
+            OperationalError,
         ]
 
         def exponential_backoff(attempt: int):
-            return attempt * attempt
+            # capped, with jitter so that threads failing together don't retry together
+            return min(30.0, 2.0**attempt) * (1 + random.random() * 0.5)
 
         return cls.retry_connection(
             connection,
@@ -180,11 +356,25 @@ class YugabytedbConnectionManager(SQLConnectionManager):
             retryable_exceptions=retryable_exceptions,
         )
 
+    @classmethod
+    def _close_handle(cls, connection):
+        # hand the connection back to its pool instead of closing it, when possible
+        with cls._pools_lock:
+            pool = cls._handle_pools.pop(id(connection.handle), None)
+        if pool is not None and pool.putconn(connection.handle):
+            # the dbt connection is closed either way, so fire the same event
+            fire_event(
+                ConnectionClosed(conn_name=cast_to_str(connection.name), node_info=get_node_info())
+            )
+            logger.debug(f"Returned connection '{connection.name}' to the pool")
+            return
+        super()._close_handle(connection)
+
     def cancel(self, connection):
         connection_name = connection.name
         try:
             pid = connection.handle.get_backend_pid()
-        except psycopg2.InterfaceError as exc:
+        except InterfaceError as exc:
             # if the connection is already closed, not much to cancel!
             if "already closed" in str(exc):
                 logger.debug(f"Connection {connection_name} was already closed")
@@ -193,38 +383,35 @@ class YugabytedbConnectionManager(SQLConnectionManager):
             raise
 
         try:
-            # yugabytedb does not support pg_terminate_backend yet so we will
-            # try our best to terminate the backend, but likely will not work till
-            # support is implemented in yugabytedb
+            # pg_terminate_backend often does not stop the running query on yugabytedb,
+            # so cancel the query instead. This also leaves the session usable, so the
+            # handle can go back to the connection pool.
             # https://github.com/yugabytedb/cockroach/issues/35897
-            sql = "select pg_terminate_backend({})".format(pid)
+            sql = f"select pg_cancel_backend({pid})"
 
-            logger.debug("Cancelling query '{}' ({})".format(connection_name, pid))
+            logger.debug(f"Cancelling query '{connection_name}' ({pid})")
 
             _, cursor = self.add_query(sql)
             res = cursor.fetchone()
 
-            logger.debug("Cancel query '{}': {}".format(connection_name, res))
+            logger.debug(f"Cancel query '{connection_name}': {res}")
         except:
             pass
 
-    @classmethod
-    def get_credentials(cls, credentials):
-        return credentials
-
     @classmethod
     def get_response(cls, cursor) -> AdapterResponse:
-        message = str(cursor.statusmessage)
+        message = cursor.statusmessage
         rows = cursor.rowcount
-        status_message_parts = message.split() if message is not None else []
-        status_messsage_strings = [part for part in status_message_parts if not part.isdigit()]
-        code = " ".join(status_messsage_strings)
+        if not message:
+            return AdapterResponse(_message="", code="", rows_affected=rows)
+        code = _STATUS_MESSAGE_DIGITS.sub("", message).strip()
         return AdapterResponse(_message=message, code=code, rows_affected=rows)
 
     @classmethod
     def data_type_code_to_name(cls, type_code: int) -> str:
-        if type_code in string_types:
-            return string_types[type_code].name
+        type_ = string_types.get(type_code)
+        if type_ is not None:
+            return type_.name
         else:
             return f"unknown type_code {type_code}"
 
@@ -232,8 +419,8 @@ class YugabytedbConnectionManager(SQLConnectionManager):
         connection = self.get_thread_connection()
         if connection.transaction_open is True:
             raise dbt.exceptions.DbtInternalError(
-                'Tried to begin a new transaction on connection "{}", but '
-                "it already had one open!".format(connection.name)
+                f'Tried to begin a new transaction on connection "{connection.name}", but '
+                "it already had one open!"
             )
 
         if connection.credentials.enable_transaction:
@@ -242,10 +429,13 @@ class YugabytedbConnectionManager(SQLConnectionManager):
             # Reference:
             #   - https://github.com/yugabytedb/cockroach/issues/41513
             #   - https://github.com/yugabytedb/cockroach/issues/54954
-            try:
-                self.add_commit_query()
-            except Exception:
-                pass
+            # The handle tracks its transaction status client side, so the extra COMMIT round
+            # trip is only needed when a transaction is actually open.
+            if connection.handle.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                try:
+                    self.add_commit_query()
+                except Exception:
+                    pass
 
             self.add_begin_query()
 
@@ -256,14 +446,19 @@ class YugabytedbConnectionManager(SQLConnectionManager):
         connection = self.get_thread_connection()
         if connection.transaction_open is False:
             raise dbt.exceptions.DbtInternalError(
-                'Tried to commit transaction on connection "{}", but '
-                "it does not have one open!".format(connection.name)
+                f'Tried to commit transaction on connection "{connection.name}", but '
+                "it does not have one open!"
             )
 
         if connection.credentials.enable_transaction:
             fire_event(SQLCommit(conn_name=connection.name, node_info=get_node_info()))
-            self.add_commit_query()
+            # skip the round trip if the transaction was already ended, e.g. by a hook
+            if connection.handle.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                self.add_commit_query()
 
         connection.transaction_open = False
 
         return connection
+
+
+atexit.register(YugabytedbConnectionManager.close_pools)
@@ -19,52 +19,60 @@ from dbt.adapters.yugabytedb.relation_configs import (
 )
 
 
+_RENAMEABLE_RELATIONS = frozenset(
+    {
+        RelationType.View,
+        RelationType.Table,
+        RelationType.MaterializedView,
+    }
+)
+_REPLACEABLE_RELATIONS = frozenset(
+    {
+        RelationType.View,
+        RelationType.Table,
+    }
+)
+
+
 @dataclass(frozen=True, eq=False, repr=False)
 class YugabytedbRelation(BaseRelation):
-    renameable_relations = frozenset(
-        {
-            RelationType.View,
-            RelationType.Table,
-            RelationType.MaterializedView,
-        }
-    )
-    replaceable_relations = frozenset(
-        {
-            RelationType.View,
-            RelationType.Table,
-        }
-    )
+    renameable_relations = _RENAMEABLE_RELATIONS
+    replaceable_relations = _REPLACEABLE_RELATIONS
+
+    _max_name_length = MAX_CHARACTERS_IN_IDENTIFIER
 
     def __post_init__(self):
         # Check for length of Yugabytedb table/view names.
         # Check self.type to exclude test relation identifiers
+        max_name_length = self._max_name_length
         if (
             self.identifier is not None
             and self.type is not None
-            and len(self.identifier) > self.relation_max_name_length()
+            and len(self.identifier) > max_name_length
         ):
             raise DbtRuntimeError(
                 f"Relation name '{self.identifier}' "
-                f"is longer than {self.relation_max_name_length()} characters"
+                f"is longer than {max_name_length} characters"
             )
 
     def relation_max_name_length(self):
-        return MAX_CHARACTERS_IN_IDENTIFIER
+        return self._max_name_length
 
     def get_materialized_view_config_change_collection(
         self, relation_results: RelationResults, runtime_config: RuntimeConfigObject
     ) -> Optional[YugabytedbMaterializedViewConfigChangeCollection]:
         config_change_collection = YugabytedbMaterializedViewConfigChangeCollection()
 
-        existing_materialized_view = YugabytedbMaterializedViewConfig.from_relation_results(
+        # only the indexes are compared, so skip building the full configs
+        existing_indexes = YugabytedbMaterializedViewConfig.indexes_from_relation_results(
             relation_results
         )
-        new_materialized_view = YugabytedbMaterializedViewConfig.from_model_node(
+        new_indexes = YugabytedbMaterializedViewConfig.indexes_from_model_node(
             runtime_config.model
         )
 
         config_change_collection.indexes = self._get_index_config_changes(
-            existing_materialized_view.indexes, new_materialized_view.indexes
+            existing_indexes, new_indexes
         )
 
         # we return `None` instead of an empty `YugabytedbMaterializedViewConfigChangeCollection` object
@@ -91,16 +99,12 @@ class YugabytedbRelation(BaseRelation):
 
         Returns: a set of index updates in the form {"action": "drop/create", "context": <IndexConfig>}
         """
-        drop_changes = set(
-            YugabytedbIndexConfigChange.from_dict(
-                {"action": RelationConfigChangeAction.drop, "context": index}
-            )
-            for index in existing_indexes.difference(new_indexes)
-        )
-        create_changes = set(
-            YugabytedbIndexConfigChange.from_dict(
-                {"action": RelationConfigChangeAction.create, "context": index}
-            )
-            for index in new_indexes.difference(existing_indexes)
-        )
-        return set().union(drop_changes, create_changes)
+        drop_changes = {
+            YugabytedbIndexConfigChange(action=RelationConfigChangeAction.drop, context=index)
+            for index in existing_indexes - new_indexes
+        }
+        create_changes = {
+            YugabytedbIndexConfigChange(action=RelationConfigChangeAction.create, context=index)
+            for index in new_indexes - existing_indexes
+        }
+        return drop_changes | create_changes
@@ -99,6 +99,32 @@ class YugabytedbMaterializedViewConfig(RelationConfigBase, RelationConfigValidat
         }
         return config_dict
 
+    @classmethod
+    def indexes_from_model_node(cls, model_node: ModelNode) -> FrozenSet[YugabytedbIndexConfig]:
+        """
+        Returns: only the `indexes` of `from_model_node()`, without building the rest of
+        the config
+        """
+        indexes: List[dict] = model_node.config.extra.get("indexes", [])
+        return frozenset(
+            YugabytedbIndexConfig.from_dict(YugabytedbIndexConfig.parse_model_node(index))
+            for index in indexes
+        )
+
+    @classmethod
+    def indexes_from_relation_results(
+        cls, relation_results: RelationResults
+    ) -> FrozenSet[YugabytedbIndexConfig]:
+        """
+        Returns: only the `indexes` of `from_relation_results()`, without building the rest
+        of the config
+        """
+        indexes: agate.Table = relation_results.get("indexes", agate.Table(rows={}))
+        return frozenset(
+            YugabytedbIndexConfig.from_dict(YugabytedbIndexConfig.parse_relation_results(index))
+            for index in indexes.rows
+        )
+
 
 @dataclass
 class YugabytedbMaterializedViewConfigChangeCollection: